@@ -21,6 +21,39 @@ from shipit_static_analysis.workflow import Workflow
 logger = get_logger(__name__)
 
 
+def load_secrets(taskcluster_secret, taskcluster_client_id, taskcluster_access_token):
+    '''
+    Load the analysis secrets from Taskcluster
+    '''
+    return get_secrets(taskcluster_secret,
+                       config.PROJECT_NAME,
+                       required=(
+                           'APP_CHANNEL',
+                           'REPORTERS',
+                           'ANALYZERS',
+                       ),
+                       existing={
+                           'APP_CHANNEL': 'development',
+                           'REPORTERS': [],
+                           'ANALYZERS': ['clang-tidy', ],
+                           'PUBLICATION': 'IN_PATCH',
+                       },
+                       taskcluster_client_id=taskcluster_client_id,
+                       taskcluster_access_token=taskcluster_access_token,
+                       )
+
+
+def load_index_service(taskcluster_client_id, taskcluster_access_token):
+    '''
+    Build the Taskcluster index client
+    '''
+    return get_service(
+        'index',
+        taskcluster_client_id,
+        taskcluster_access_token,
+    )
+
+
 @click.command()
 @taskcluster_options
 @click.option(
@@ -55,22 +88,7 @@ def main(source,
          taskcluster_access_token,
          ):
 
-    secrets = get_secrets(taskcluster_secret,
-                          config.PROJECT_NAME,
-                          required=(
-                              'APP_CHANNEL',
-                              'REPORTERS',
-                              'ANALYZERS',
-                          ),
-                          existing={
-                              'APP_CHANNEL': 'development',
-                              'REPORTERS': [],
-                              'ANALYZERS': ['clang-tidy', ],
-                              'PUBLICATION': 'IN_PATCH',
-                          },
-                          taskcluster_client_id=taskcluster_client_id,
-                          taskcluster_access_token=taskcluster_access_token,
-                          )
+    secrets = load_secrets(taskcluster_secret, taskcluster_client_id, taskcluster_access_token)
 
     init_logger(config.PROJECT_NAME,
                 PAPERTRAIL_HOST=secrets.get('PAPERTRAIL_HOST'),
@@ -95,11 +113,7 @@ def main(source,
     )
 
     # Load index service
-    index_service = get_service(
-        'index',
-        taskcluster_client_id,
-        taskcluster_access_token,
-    )
+    index_service = load_index_service(taskcluster_client_id, taskcluster_access_token)
 
     # Load unique revision
     if source == 'phabricator':
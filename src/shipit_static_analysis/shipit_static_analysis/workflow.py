@@ -191,6 +191,11 @@ class Workflow(object):
             return
 
         self.index(revision, state='analyzing')
+
+        # Build analyzers once, as they can be used before and after
+        # applying the patch (clang-tidy checks validation is costly)
+        analyzers = [analyzer_class() for analyzer_class in analyzers]
+
         with stats.api.timer('runtime.issues'):
             # Detect initial issues
             if settings.publication == Publication.BEFORE_AFTER:
@@ -240,12 +245,9 @@ class Workflow(object):
         Detect issues for this revision
         '''
         issues = []
-        for analyzer_class in analyzers:
-            # Build analyzer
-            logger.info('Run {}'.format(analyzer_class.__name__))
-            analyzer = analyzer_class()
-
+        for analyzer in analyzers:
             # Run analyzer on revision and store generated issues
+            logger.info('Run {}'.format(analyzer.__class__.__name__))
             issues += analyzer.run(revision)
 
         return issues
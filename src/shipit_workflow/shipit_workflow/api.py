@@ -8,14 +8,20 @@ import functools
 import os
 
 import flask
+import requests
+import sqlalchemy as sa
 import taskcluster
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm import selectinload
 from werkzeug.exceptions import BadRequest
 
 from backend_common.auth0 import mozilla_accept_token
 from cli_common.log import get_logger
+from cli_common.utils import ThreadPoolExecutorResult
 from shipit_workflow.models import Phase
 from shipit_workflow.models import Release
+from shipit_workflow.models import release_row_to_json
 from shipit_workflow.tasks import UnsupportedFlavor
 from shipit_workflow.tasks import fetch_actions_json
 from shipit_workflow.tasks import generate_action_task
@@ -23,40 +29,94 @@ from shipit_workflow.tasks import render_action_task
 
 log = get_logger(__name__)
 
+# Maximum number of concurrent requests sent to Taskcluster
+MAX_TASKCLUSTER_WORKERS = 8
 
+# some parameters contain a lot of entries, so we hit the payload size limit.
+# We don't use these parameters when cancelling a release, safe to remove
+_LONG_PARAMS = frozenset({'existing_tasks', 'release_history', 'release_partner_config'})
+
+# Lookup queries are compiled once and cached, only their parameters change.
+# They need the actual Session (session()), flask_sqlalchemy's scoped_session
+# does not proxy the attributes used by baked queries
+_bakery = baked.bakery()
+
+_release_by_name = _bakery(lambda session: session.query(Release))
+_release_by_name += lambda q: q.filter(Release.name == sa.bindparam('name'))
+
+_release_with_phases_by_name = _bakery(lambda session: session.query(Release))
+_release_with_phases_by_name += lambda q: q.options(selectinload(Release.phases))
+_release_with_phases_by_name += lambda q: q.filter(Release.name == sa.bindparam('name'))
+
+_phase_by_name = _bakery(lambda session: session.query(Phase))
+_phase_by_name += lambda q: q.join(Release, Release.id == Phase.release_id)
+_phase_by_name += lambda q: q.filter(Release.name == sa.bindparam('name'))
+_phase_by_name += lambda q: q.filter(Phase.name == sa.bindparam('phase'))
+
+_phase_to_schedule_by_name = _bakery(lambda session: session.query(Phase))
+_phase_to_schedule_by_name += lambda q: q.join(Release, Release.id == Phase.release_id)
+_phase_to_schedule_by_name += lambda q: q.options(
+    # Also load the deferred task & context, needed to render the phase
+    load_only('id', 'name', 'submitted', 'task_id', 'task', 'context', 'release_id'),
+)
+_phase_to_schedule_by_name += lambda q: q.filter(Release.name == sa.bindparam('name'))
+_phase_to_schedule_by_name += lambda q: q.filter(Phase.name == sa.bindparam('phase'))
+
+_MISSING_USERINFO_RESPONSE = (
+    {'error': 'missing_userinfo', 'error_description': 'Userinfo is missing'},
+    401,
+    {'WWW-Authenticate': 'Bearer'},
+)
+_INVALID_PERMISSIONS_RESPONSE = (
+    {'error': 'invalid_permissions', 'error_description': 'Check your permissions'},
+    401,
+    {'WWW-Authenticate': 'Bearer'},
+)
+
+
+@functools.lru_cache(maxsize=1)
 def _queue():
+    # Keep as many connections alive as concurrent requests we send, retries
+    # are already handled by the Taskcluster client (maxRetries)
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=MAX_TASKCLUSTER_WORKERS))
     queue = taskcluster.Queue({
         'credentials': {
             'clientId': os.environ.get('TASKCLUSTER_CLIENT_ID'),
             'accessToken': os.environ.get('TASKCLUSTER_ACCESS_TOKEN')
         },
         'maxRetries': 12
-    })
+    }, session=session)
     return queue
 
 
-def validate_user(key, checker):
+def _reset_queue():
+    '''Drop the cached Taskcluster queue client, used by tests
+    '''
+    _queue.cache_clear()
+
+
+def validate_user(key, required_groups=frozenset({'releng'})):
+    required_groups = frozenset(required_groups)
+
     def wrapper(view_func):
         @functools.wraps(view_func)
         def decorated(*args, **kwargs):
-            try:
-                if checker(flask.g.userinfo[key]):
-                    return view_func(*args, **kwargs)
-            except (AttributeError, KeyError):
-                response_body = {'error': 'missing_userinfo',
-                                 'error_description': 'Userinfo is missing'}
-                return response_body, 401, {'WWW-Authenticate': 'Bearer'}
-
-            response_body = {'error': 'invalid_permissions',
-                             'error_description': 'Check your permissions'}
-            return response_body, 401, {'WWW-Authenticate': 'Bearer'}
+            userinfo = getattr(flask.g, 'userinfo', None)
+            if not userinfo:
+                return _MISSING_USERINFO_RESPONSE
+            groups = userinfo.get(key)
+            if groups is None:
+                return _MISSING_USERINFO_RESPONSE
+            if required_groups.isdisjoint(groups):
+                return _INVALID_PERMISSIONS_RESPONSE
+            return view_func(*args, **kwargs)
         return decorated
     return wrapper
 
 
 @mozilla_accept_token()
-@validate_user(key='https://sso.mozilla.com/claim/groups',
-               checker=lambda xs: 'releng' in xs)
+@validate_user(key='https://sso.mozilla.com/claim/groups')
 def add_release(body):
     session = flask.g.db.session
     r = Release(
@@ -70,6 +130,8 @@ def add_release(body):
         partial_updates=body.get('partial_updates')
     )
     try:
+        # Phases generation talks to Taskcluster: do it before using the
+        # database session, so no transaction is kept open meanwhile
         r.generate_phases(
             partner_urls=flask.current_app.config.get('PARTNERS_URL'),
             github_token=flask.current_app.config.get('GITHUB_TOKEN'),
@@ -84,54 +146,75 @@ def add_release(body):
 def list_releases(product=None, branch=None, version=None, build_number=None,
                   status=['scheduled']):
     session = flask.g.db.session
-    releases = session.query(Release)
+    # Only select the serialized columns, skipping ORM instances creation
+    releases = sa.select([
+        Release.id,
+        Release.name,
+        Release.product,
+        Release.branch,
+        Release.version,
+        Release.revision,
+        Release.build_number,
+        Release.release_eta,
+        Release.status,
+    ])
     if product:
-        releases = releases.filter(Release.product == product)
+        releases = releases.where(Release.product == product)
     if branch:
-        releases = releases.filter(Release.branch == branch)
+        releases = releases.where(Release.branch == branch)
     if version:
-        releases = releases.filter(Release.version == version)
+        releases = releases.where(Release.version == version)
         if build_number:
-            releases = releases.filter(Release.build_number == build_number)
+            releases = releases.where(Release.build_number == build_number)
     elif build_number:
         raise BadRequest(description='Filtering by build_number without version'
                          ' is not supported.')
-    releases = releases.filter(Release.status.in_(status))
-    return [r.json for r in releases.all()]
+    releases = releases.where(Release.status.in_(status))
+    releases = session.execute(releases).fetchall()
+    if not releases:
+        return []
+
+    phases = _load_phases(session, [r.id for r in releases])
+    return [release_row_to_json(r, phases.get(r.id, [])) for r in releases]
+
+
+def _load_phases(session, release_ids):
+    '''Load the phases of several releases in a single query, grouped by
+       release id
+    '''
+    phases = {}
+    rows = session.execute(
+        sa.select([Phase.release_id, Phase.name, Phase.submitted, Phase.task_id])
+        .where(Phase.release_id.in_(release_ids))
+        .order_by(Phase.id)
+    )
+    for row in rows:
+        phases.setdefault(row.release_id, []).append(row)
+    return phases
 
 
 def get_release(name):
     session = flask.g.db.session
-    try:
-        release = session.query(Release).filter(Release.name == name).one()
-        return release.json
-    except NoResultFound:
+    release = _release_by_name(session()).params(name=name).one_or_none()
+    if release is None:
         flask.abort(404)
+    return release.json
 
 
 def get_phase(name, phase):
     session = flask.g.db.session
-    try:
-        phase = session.query(Phase) \
-            .filter(Release.id == Phase.release_id) \
-            .filter(Release.name == name) \
-            .filter(Phase.name == phase).one()
-        return phase.json
-    except NoResultFound:
+    phase = _phase_by_name(session()).params(name=name, phase=phase).one_or_none()
+    if phase is None:
         flask.abort(404)
+    return phase.json
 
 
 @mozilla_accept_token()
-@validate_user(key='https://sso.mozilla.com/claim/groups',
-               checker=lambda xs: 'releng' in xs)
+@validate_user(key='https://sso.mozilla.com/claim/groups')
 def schedule_phase(name, phase):
     session = flask.g.db.session
-    try:
-        phase = session.query(Phase) \
-            .filter(Release.id == Phase.release_id) \
-            .filter(Release.name == name) \
-            .filter(Phase.name == phase).one()
-    except NoResultFound:
+    phase = _phase_to_schedule_by_name(session()).params(name=name, phase=phase).one_or_none()
+    if phase is None:
         flask.abort(404)
 
     if phase.submitted:
@@ -141,44 +224,78 @@ def schedule_phase(name, phase):
     phase.submitted = True
     phase.completed_by = flask.g.userinfo['email']
     phase.completed = datetime.datetime.utcnow()
-    if all([ph.submitted for ph in phase.release.phases]):
-        phase.release.status = 'shipped'
+    # Mark the release as shipped once all its phases are submitted: check and
+    # write in one statement; not race-free without locking the release row
+    session.flush()
+    session.execute(
+        sa.update(Release.__table__)
+        .where(Release.id == phase.release_id)
+        .where(~sa.exists().where(Phase.release_id == Release.id).where(Phase.submitted.is_(False)))
+        .values(status='shipped')
+    )
     session.commit()
     return phase.json
 
 
+def _without_long_params(actions):
+    '''Shallow copy of an actions.json document without the long parameters,
+       so they are not deep copied and rendered for every phase
+    '''
+    variables = actions['variables']
+    parameters = {
+        key: value
+        for key, value in variables['parameters'].items()
+        if key not in _LONG_PARAMS
+    }
+    return dict(actions, variables=dict(variables, parameters=parameters))
+
+
+def _cancel_phase(queue, phase_name, phase_task_id, actions):
+    '''Cancel the task group created by a submitted phase
+    '''
+    action_task_id, action_task, context = generate_action_task(
+        action_name='cancel-all',
+        action_task_input={},
+        actions=actions,
+    )
+    # ACTION_TASK_ID should be explicitly specified and be the original
+    # action task that generated this phase.
+    action_task = render_action_task(task=action_task, context=context,
+                                     action_task_id=phase_task_id)
+    # Add the initial action task to the list of dependencies to
+    # prevent early firing
+    action_task['dependencies'].append(phase_task_id)
+    log.info('Cancel phase %s by task %s', phase_name, action_task_id)
+    queue.createTask(action_task_id, action_task)
+
+
 @mozilla_accept_token()
-@validate_user(key='https://sso.mozilla.com/claim/groups',
-               checker=lambda xs: 'releng' in xs)
+@validate_user(key='https://sso.mozilla.com/claim/groups')
 def abandon_release(name):
     session = flask.g.db.session
-    try:
-        release = session.query(Release).filter(Release.name == name).one()
-        # Cancel all submitted task groups first
-        for phase in filter(lambda x: x.submitted, release.phases):
-            actions = fetch_actions_json(phase.task_id)
-            action_task_id, action_task, context = generate_action_task(
-                action_name='cancel-all',
-                action_task_input={},
-                actions=actions,
-            )
-            # some parameters contain a lot of entries, so we hit the payload
-            # size limit. We don't use this parameter in any case, safe to
-            # remove
-            for long_param in ('existing_tasks', 'release_history', 'release_partner_config'):
-                del context['parameters'][long_param]
-            # ACTION_TASK_ID should be explicitly specified and be the original
-            # action task that generated this phase.
-            action_task = render_action_task(task=action_task, context=context,
-                                             action_task_id=phase.task_id)
-            # Add the initial action task to the list of dependencies to
-            # prevent early firing
-            action_task['dependencies'].append(phase.task_id)
-            log.info('Cancel phase %s by task %s', phase.name, action_task_id)
-            _queue().createTask(action_task_id, action_task)
-
-        release.status = 'aborted'
-        session.commit()
-        return release.json
-    except NoResultFound:
+    release = _release_with_phases_by_name(session()).params(name=name).one_or_none()
+    if release is None:
         flask.abort(404)
+
+    # Cancel all submitted task groups first
+    # Every phase needs a couple of requests to Taskcluster, so run them
+    # in parallel: the first failure is raised before committing
+    submitted_phases = [phase for phase in release.phases if phase.submitted]
+    if submitted_phases:
+        queue = _queue()
+        max_workers = min(MAX_TASKCLUSTER_WORKERS, len(submitted_phases))
+        # Only download actions.json once per action task
+        task_ids = list({phase.task_id for phase in submitted_phases})
+        with ThreadPoolExecutorResult(max_workers=max_workers) as executor:
+            actions_by_task = {
+                task_id: _without_long_params(actions)
+                for task_id, actions in zip(task_ids, executor.map(fetch_actions_json, task_ids))
+            }
+        with ThreadPoolExecutorResult(max_workers=max_workers) as executor:
+            for phase in submitted_phases:
+                executor.submit(_cancel_phase, queue, phase.name, phase.task_id,
+                                actions_by_task[phase.task_id])
+
+    release.status = 'aborted'
+    session.commit()
+    return release.json
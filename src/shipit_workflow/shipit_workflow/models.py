@@ -25,14 +25,44 @@ from shipit_workflow.tasks import render_action_task
 log = get_logger(__name__)
 
 
+def phase_row_to_json(row):
+    '''Serialize a phase, either a Phase instance or a database row
+    '''
+    return {
+        'name': row.name,
+        'submitted': row.submitted,
+        'actionTaskId': row.task_id,
+    }
+
+
+def release_row_to_json(row, phases):
+    '''Serialize a release, either a Release instance or a database row,
+       along with its phases
+    '''
+    return {
+        'name': row.name,
+        'product': row.product,
+        'branch': row.branch,
+        'project': row.branch.split('/')[-1],
+        'version': row.version,
+        'revision': row.revision,
+        'build_number': row.build_number,
+        'release_eta': row.release_eta or '',
+        'status': row.status,
+        'phases': [phase_row_to_json(p) for p in phases],
+    }
+
+
 class Phase(db.Model):
     __tablename__ = 'shipit_workflow_phases'
     id = sa.Column(sa.Integer, primary_key=True)
     name = sa.Column(sa.String, nullable=False)
     submitted = sa.Column(sa.Boolean, nullable=False, default=False)
     task_id = sa.Column(sa.String, nullable=False)
-    task = sa.Column(sa.Text, nullable=False)
-    context = sa.Column(sa.Text, nullable=False)
+    # The action task and its context can be large and are only needed to
+    # render the task when the phase is scheduled
+    task = sqlalchemy.orm.deferred(sa.Column(sa.Text, nullable=False), group='rendered')
+    context = sqlalchemy.orm.deferred(sa.Column(sa.Text, nullable=False), group='rendered')
     created = sa.Column(sa.DateTime, default=datetime.datetime.utcnow)
     completed = sa.Column(sa.DateTime)
     completed_by = sa.Column(sa.String)
@@ -60,11 +90,7 @@ class Phase(db.Model):
 
     @property
     def json(self):
-        return {
-            'name': self.name,
-            'submitted': self.submitted,
-            'actionTaskId': self.task_id,
-        }
+        return phase_row_to_json(self)
 
 
 class Release(db.Model):
@@ -97,6 +123,8 @@ class Release(db.Model):
         # Swagger doesn't let passing null values for strings, we use "falsy"
         # ones instead
         self.release_eta = release_eta or None
+        # Only used to generate the phases: it is not persisted, nor part of
+        # the serialized release, so it never goes through a JSON round-trip
         self.partial_updates = partial_updates
         self.status = status
 
@@ -107,6 +135,7 @@ class Release(db.Model):
     def generate_phases(self, partner_urls=None, github_token=None):
         blob = []
         phases = []
+        actions = self.actions
         previous_graph_ids = [self.decicion_task_id]
         next_version = bump_version(self.version.replace('esr', ''))
         input_common = {
@@ -129,14 +158,14 @@ class Release(db.Model):
                     'buildNumber': info['buildNumber'],
                     'locales': info['locales']
                 }
-        for phase in self.release_promotion_flavors():
+        for phase in self.release_promotion_flavors(actions):
             action_task_input = copy.deepcopy(input_common)
             action_task_input['previous_graph_ids'] = list(previous_graph_ids)
             action_task_input['release_promotion_flavor'] = phase['name']
             action_task_id, action_task, context = generate_action_task(
                 action_name='release-promotion',
                 action_task_input=action_task_input,
-                actions=self.actions,
+                actions=actions,
             )
             blob.append({
                 'task_id': action_task_id,
@@ -157,8 +186,10 @@ class Release(db.Model):
     def actions(self):
         return fetch_actions_json(self.decicion_task_id)
 
-    def release_promotion_flavors(self):
-        relpro = find_action('release-promotion', self.actions)
+    def release_promotion_flavors(self, actions=None):
+        if actions is None:
+            actions = self.actions
+        relpro = find_action('release-promotion', actions)
         avail_flavors = relpro['schema']['properties']['release_promotion_flavor']['enum']
         our_flavors = extract_our_flavors(avail_flavors, self.product,
                                           self.version, self.partial_updates)
@@ -166,15 +197,4 @@ class Release(db.Model):
 
     @property
     def json(self):
-        return {
-            'name': self.name,
-            'product': self.product,
-            'branch': self.branch,
-            'project': self.project,
-            'version': self.version,
-            'revision': self.revision,
-            'build_number': self.build_number,
-            'release_eta': self.release_eta or '',
-            'status': self.status,
-            'phases': [p.json for p in self.phases],
-        }
+        return release_row_to_json(self, self.phases)
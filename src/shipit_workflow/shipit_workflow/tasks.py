@@ -4,6 +4,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import copy
+from functools import lru_cache
 
 import jsone
 import requests
@@ -69,6 +70,8 @@ def find_decision_task_id(project, revision):
     return index.findTask(decision_task_route)['taskId']
 
 
+# actions.json documents can be large, only keep a few of them around
+@lru_cache(maxsize=16)
 def fetch_actions_json(task_id):
     queue = taskcluster.Queue()
     actions_url = queue.buildUrl('getLatestArtifact', task_id, 'public/actions.json')
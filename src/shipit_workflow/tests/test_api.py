@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+from unittest import mock
+
+import flask
+import pytest
+
+import backend_common.testing
+import shipit_workflow.api
+from shipit_workflow.api import _without_long_params
+from shipit_workflow.api import validate_user
+from shipit_workflow.models import Phase
+from shipit_workflow.models import Release
+
+
+ACTIONS = {
+    'actions': [
+        {'name': 'cancel-all', 'task': {'dependencies': []}},
+    ],
+    'variables': {
+        'parameters': {
+            'project': 'mozilla-beta',
+            'existing_tasks': {'build': 'abcd'},
+        },
+    },
+}
+
+
+def test_validate_user(app):
+    view = validate_user(key='groups')(lambda: 'ok')
+
+    with app.test_request_context():
+        body, status, headers = view()
+        assert status == 401
+        assert body['error'] == 'missing_userinfo'
+
+        flask.g.userinfo = {'email': 'test@mozilla.com'}
+        body, status, headers = view()
+        assert status == 401
+        assert body['error'] == 'missing_userinfo'
+
+        flask.g.userinfo = {'groups': ['other']}
+        body, status, headers = view()
+        assert status == 401
+        assert body['error'] == 'invalid_permissions'
+
+        flask.g.userinfo = {'groups': ['other', 'releng']}
+        assert view() == 'ok'
+
+
+def test_without_long_params():
+    actions = {
+        'actions': [],
+        'variables': {
+            'parameters': {
+                'project': 'mozilla-beta',
+                'existing_tasks': {'build': 'abcd'},
+                'release_history': {},
+            },
+        },
+    }
+    trimmed = _without_long_params(actions)
+
+    assert trimmed['variables']['parameters'] == {'project': 'mozilla-beta'}
+    assert trimmed['actions'] is actions['actions']
+    # The original (cached) document is left untouched
+    assert 'existing_tasks' in actions['variables']['parameters']
+
+
+@pytest.fixture
+def release(app):
+    '''Store a release with a submitted and a pending phase
+    '''
+    session = app.db.session
+    release = Release(
+        product='firefox',
+        version='60.0b1',
+        branch='releases/mozilla-beta',
+        revision='abcd1234',
+        build_number=1,
+        release_eta=None,
+        partial_updates=None,
+        status='scheduled',
+    )
+    task = json.dumps({'dependencies': []})
+    release.phases = [
+        Phase('promote_firefox', 'promoteTaskId', task, json.dumps({}), submitted=True),
+        Phase('push_firefox', 'pushTaskId', task, json.dumps({})),
+    ]
+    session.add(release)
+    session.commit()
+
+    yield release
+
+    session.rollback()
+    session.query(Phase).delete()
+    session.query(Release).delete()
+    session.commit()
+
+
+@pytest.fixture
+def releng_user(monkeypatch):
+    '''Give the mocked auth0 user the releng group
+    '''
+    monkeypatch.setitem(backend_common.testing.AUTH0_DUMMY_USERINFO,
+                        'https://sso.mozilla.com/claim/groups', ['releng'])
+    return [('Authorization', 'Bearer releng-token')]
+
+
+@pytest.fixture
+def mock_queue(monkeypatch):
+    queue = mock.Mock()
+    monkeypatch.setattr(shipit_workflow.api, '_queue', lambda: queue)
+    return queue
+
+
+@pytest.fixture
+def releases(app, release):
+    '''Store a few more releases next to the default one
+    '''
+    session = app.db.session
+    task = json.dumps({'dependencies': []})
+    devedition = Release(
+        product='devedition',
+        version='60.0b1',
+        branch='releases/mozilla-beta',
+        revision='abcd1234',
+        build_number=1,
+        release_eta=None,
+        partial_updates=None,
+        status='scheduled',
+    )
+    devedition.phases = [
+        Phase('promote_devedition', 'promoteDevTaskId', task, json.dumps({})),
+        Phase('push_devedition', 'pushDevTaskId', task, json.dumps({})),
+        Phase('ship_devedition', 'shipDevTaskId', task, json.dumps({})),
+    ]
+    aborted = Release(
+        product='firefox',
+        version='59.0',
+        branch='releases/mozilla-release',
+        revision='efgh5678',
+        build_number=2,
+        release_eta=None,
+        partial_updates=None,
+        status='aborted',
+    )
+    aborted.phases = [
+        Phase('promote_firefox', 'promoteOldTaskId', task, json.dumps({}), submitted=True),
+    ]
+    session.add_all([devedition, aborted])
+    session.commit()
+    return [release, devedition, aborted]
+
+
+def test_list_releases(client, releases):
+    def list_releases(query_string=None):
+        resp = client.get('/releases', query_string=query_string)
+        assert resp.status_code == 200
+        data = json.loads(resp.data.decode('utf-8'))
+        return {r['name']: [p['name'] for p in r['phases']] for r in data}
+
+    # Only scheduled releases by default, each with its own phases in order
+    assert list_releases() == {
+        'firefox-60.0b1-build1': ['promote_firefox', 'push_firefox'],
+        'devedition-60.0b1-build1': ['promote_devedition', 'push_devedition', 'ship_devedition'],
+    }
+    assert list_releases({'product': 'firefox'}) == {
+        'firefox-60.0b1-build1': ['promote_firefox', 'push_firefox'],
+    }
+    assert list_releases({'status': 'aborted'}) == {
+        'firefox-59.0-build2': ['promote_firefox'],
+    }
+    assert set(list_releases({'product': 'firefox', 'status': 'scheduled,aborted'})) == {
+        'firefox-60.0b1-build1',
+        'firefox-59.0-build2',
+    }
+    assert set(list_releases({'version': '60.0b1', 'build_number': 1})) == {
+        'firefox-60.0b1-build1',
+        'devedition-60.0b1-build1',
+    }
+    assert list_releases({'version': '59.0', 'build_number': 1, 'status': 'aborted'}) == {}
+    assert list_releases({'version': '61.0'}) == {}
+
+    resp = client.get('/releases', query_string={'build_number': 1})
+    assert resp.status_code == 400
+
+
+def test_get_release(client, release):
+    resp = client.get('/releases/firefox-60.0b1-build1')
+    assert resp.status_code == 200
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['name'] == 'firefox-60.0b1-build1'
+    assert data['status'] == 'scheduled'
+    assert [p['name'] for p in data['phases']] == ['promote_firefox', 'push_firefox']
+
+    resp = client.get('/releases/firefox-1.0-build1')
+    assert resp.status_code == 404
+
+
+def test_get_phase(client, release):
+    resp = client.get('/releases/firefox-60.0b1-build1/push_firefox')
+    assert resp.status_code == 200
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data == {'name': 'push_firefox', 'submitted': False, 'actionTaskId': 'pushTaskId'}
+
+    resp = client.get('/releases/firefox-60.0b1-build1/ship_firefox')
+    assert resp.status_code == 404
+    resp = client.get('/releases/firefox-1.0-build1/push_firefox')
+    assert resp.status_code == 404
+
+
+def test_schedule_phase(client, release, releng_user, mock_queue):
+    resp = client.put('/releases/firefox-1.0-build1/push_firefox', headers=releng_user)
+    assert resp.status_code == 404
+    assert not mock_queue.createTask.called
+
+    resp = client.put('/releases/firefox-60.0b1-build1/push_firefox', headers=releng_user)
+    assert resp.status_code == 200
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['submitted'] is True
+    mock_queue.createTask.assert_called_once_with('pushTaskId', {'dependencies': []})
+
+    # All phases are submitted now
+    resp = client.get('/releases/firefox-60.0b1-build1')
+    assert json.loads(resp.data.decode('utf-8'))['status'] == 'shipped'
+
+    resp = client.put('/releases/firefox-60.0b1-build1/push_firefox', headers=releng_user)
+    assert resp.status_code == 409
+
+
+def test_abandon_release(client, release, releng_user, mock_queue, monkeypatch):
+    fetch_actions_json = mock.Mock(return_value=ACTIONS)
+    monkeypatch.setattr(shipit_workflow.api, 'fetch_actions_json', fetch_actions_json)
+
+    resp = client.delete('/releases/firefox-1.0-build1', headers=releng_user)
+    assert resp.status_code == 404
+    assert not mock_queue.createTask.called
+
+    resp = client.delete('/releases/firefox-60.0b1-build1', headers=releng_user)
+    assert resp.status_code == 200
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['status'] == 'aborted'
+
+    # Only the submitted phase is cancelled
+    fetch_actions_json.assert_called_once_with('promoteTaskId')
+    assert mock_queue.createTask.call_count == 1
+    action_task_id, action_task = mock_queue.createTask.call_args[0]
+    assert action_task['dependencies'] == ['promoteTaskId']
+
+
+def test_abandon_release_failure(app, client, release, releng_user, mock_queue, monkeypatch):
+    release.phases[1].submitted = True
+    app.db.session.commit()
+    monkeypatch.setattr(shipit_workflow.api, 'fetch_actions_json', mock.Mock(return_value=ACTIONS))
+    mock_queue.createTask.side_effect = Exception('Taskcluster is down')
+    # Let the error handlers turn the exception into a response
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', False)
+
+    resp = client.delete('/releases/firefox-60.0b1-build1', headers=releng_user)
+    assert resp.status_code == 500
+    assert mock_queue.createTask.called
+
+    # The release is left as is, it can be abandoned again
+    resp = client.get('/releases/firefox-60.0b1-build1')
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['status'] == 'scheduled'
+
+
+def test_abandon_release_shared_actions(app, client, release, releng_user, mock_queue, monkeypatch):
+    # Phases scheduled by the same action task share its actions.json
+    task = json.dumps({'dependencies': []})
+    release.phases[1].submitted = True
+    release.phases[1].task_id = 'promoteTaskId'
+    release.phases.append(Phase('ship_firefox', 'promoteTaskId', task, json.dumps({}), submitted=True))
+    app.db.session.commit()
+    fetch_actions_json = mock.Mock(return_value=ACTIONS)
+    monkeypatch.setattr(shipit_workflow.api, 'fetch_actions_json', fetch_actions_json)
+
+    resp = client.delete('/releases/firefox-60.0b1-build1', headers=releng_user)
+    assert resp.status_code == 200
+
+    assert fetch_actions_json.call_count == 1
+    fetch_actions_json.assert_called_once_with('promoteTaskId')
+    assert mock_queue.createTask.call_count == 3
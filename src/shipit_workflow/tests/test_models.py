@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+
+from shipit_workflow.models import release_row_to_json
+
+ReleaseRow = collections.namedtuple('ReleaseRow', 'name product branch version revision build_number release_eta status')
+PhaseRow = collections.namedtuple('PhaseRow', 'name submitted task_id')
+
+
+def test_release_row_to_json():
+    release = ReleaseRow('firefox-60.0b1-build1', 'firefox', 'releases/mozilla-beta',
+                         '60.0b1', 'abcd1234', 1, None, 'scheduled')
+    phases = [
+        PhaseRow('promote_firefox', True, 'task1'),
+        PhaseRow('push_firefox', False, 'task2'),
+    ]
+    assert release_row_to_json(release, phases) == {
+        'name': 'firefox-60.0b1-build1',
+        'product': 'firefox',
+        'branch': 'releases/mozilla-beta',
+        'project': 'mozilla-beta',
+        'version': '60.0b1',
+        'revision': 'abcd1234',
+        'build_number': 1,
+        'release_eta': '',
+        'status': 'scheduled',
+        'phases': [
+            {'name': 'promote_firefox', 'submitted': True, 'actionTaskId': 'task1'},
+            {'name': 'push_firefox', 'submitted': False, 'actionTaskId': 'task2'},
+        ],
+    }